@@ -5,23 +5,192 @@ This module provides improved alignment functions with better handling of contra
 as well as consistent dependency distance and depth calculations that are sentence-local.
 """
 
-import re
-from typing import List, Optional
+import string
+import sys
+import weakref
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
+from spacy.attrs import HEAD, SENT_START
+from spacy.symbols import PUNCT as _PUNCT_ID
 
-# Two-pass normalization regex patterns
-_punct_re_pass1 = re.compile(r"[^\w'\-]+", flags=re.UNICODE)  # Keep alphanumerics, apostrophes, hyphens
-_punct_re_pass2 = re.compile(r"['\-]", flags=re.UNICODE)    # Strip apostrophes and hyphens
 
+# Two-pass normalization keeps word characters (alphanumerics and "_") plus
+# apostrophes and hyphens in pass1, and also strips apostrophes/hyphens in pass2
+_KEEP_PUNCT = frozenset("_'-")
 
+# ASCII translation tables (fast path)
+_PASS1_DROP = {
+    c: None for c in range(128)
+    if not (chr(c).isalnum() or chr(c) in _KEEP_PUNCT)
+}
+_PASS2_STRIP = {ord("'"): None, ord("-"): None}
+_PASS2_DROP = {**_PASS1_DROP, **_PASS2_STRIP}
+
+# ASCII characters that normalize away entirely in pass1
+_PUNCT_ONLY = frozenset(string.punctuation) - _KEEP_PUNCT
+
+
+# Normalized forms are interned so that the many repeated short tokens
+# (function words, affixes) compare equal by identity in the aligner. Token
+# frequencies are Zipfian, so both normalizers are memoized as well; the
+# caches are process-local (call cache_clear() to reset them).
+@lru_cache(maxsize=4096)
 def normalize_token_pass1(s: str) -> str:
     """First pass normalization: lowercase; keep apostrophes & hyphens; strip other punct."""
-    return _punct_re_pass1.sub("", s.lower())
+    if s.isascii():
+        return sys.intern(s.lower().translate(_PASS1_DROP))
+    return sys.intern("".join(ch for ch in s.lower() if ch.isalnum() or ch in _KEEP_PUNCT))
 
 
+@lru_cache(maxsize=4096)
 def normalize_token_pass2(s: str) -> str:
     """Second pass normalization: also strip apostrophes & hyphens for tolerant matching."""
-    return _punct_re_pass2.sub("", normalize_token_pass1(s))
+    if s.isascii():
+        return sys.intern(s.lower().translate(_PASS2_DROP))
+    return sys.intern(normalize_token_pass1(s).translate(_PASS2_STRIP))
+
+
+# AOI lists shorter than this are aligned by direct scanning; building the
+# window index does not pay off for them
+_INDEX_MIN_AOI = 8
+
+
+def _scan_windows(
+    norm1: Sequence[str],
+    norm2: Sequence[str],
+    tgt_pass1: str,
+    tgt_pass2: str,
+    j: int,
+    max_window: int
+) -> Optional[Tuple[int, int]]:
+    """Return the first (start, width) window at or after j matching either target."""
+    N = len(norm1)
+    len_pass1 = len(tgt_pass1)
+    len_pass2 = len(tgt_pass2)
+    for k in range(j, N):
+        window_norm_pass1 = ""
+        window_norm_pass2 = ""
+        for w in range(1, max_window + 1):
+            if k + w > N:
+                break
+
+            # Extend the running window concatenations by one token (for w == 1
+            # this is the interned normalized token itself)
+            window_norm_pass1 += norm1[k + w - 1]
+            window_norm_pass2 += norm2[k + w - 1]
+
+            # Try pass1 normalization first (preserves apostrophes/hyphens),
+            # then pass2 normalization (strips apostrophes/hyphens)
+            if window_norm_pass1 == tgt_pass1 or window_norm_pass2 == tgt_pass2:
+                return k, w
+
+            # Windows only grow, so stop widening once both outgrow their targets
+            if len(window_norm_pass1) > len_pass1 and len(window_norm_pass2) > len_pass2:
+                break
+    return None
+
+
+def _build_window_index(norms: Sequence[str], max_window: int) -> Dict[str, List[Tuple[int, int]]]:
+    """Map every window concatenation to its (start, width) postings in scan order."""
+    index: Dict[str, List[Tuple[int, int]]] = {}
+    N = len(norms)
+    for k in range(N):
+        window = ""
+        for w in range(1, min(max_window, N - k) + 1):
+            window += norms[k + w - 1]
+            index.setdefault(window, []).append((k, w))
+    return index
+
+
+def _lookup_window(
+    index: Dict[str, List[Tuple[int, int]]],
+    target: str,
+    j: int
+) -> Optional[Tuple[int, int]]:
+    """Return the first indexed (start, width) window for target starting at or after j."""
+    postings = index.get(target)
+    if not postings:
+        return None
+    pos = bisect_left(postings, (j, 0))
+    return postings[pos] if pos < len(postings) else None
+
+
+@lru_cache(maxsize=4096)
+def _normalize_doc(doc_tokens: Tuple[str, ...]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Pass1 and pass2 normalizations of a doc's tokens, shared across batch calls."""
+    return (
+        tuple(normalize_token_pass1(t) for t in doc_tokens),
+        tuple(normalize_token_pass2(t) for t in doc_tokens),
+    )
+
+
+@lru_cache(maxsize=256)
+def _index_doc(doc_tokens: Tuple[str, ...], max_window: int) -> Tuple[dict, dict]:
+    """Pass1 and pass2 window indexes of a doc's tokens, shared across batch calls."""
+    norm1, norm2 = _normalize_doc(doc_tokens)
+    return _build_window_index(norm1, max_window), _build_window_index(norm2, max_window)
+
+
+def _align(
+    aoi_tokens: List[str],
+    doc_tokens: List[str],
+    norm1: Sequence[str],
+    norm2: Sequence[str],
+    index1: Optional[dict],
+    index2: Optional[dict],
+    max_window: int
+) -> List[Optional[int]]:
+    """Greedy alignment over precomputed normalizations (and optional window indexes)."""
+    mapping: List[Optional[int]] = [None] * len(aoi_tokens)
+    j = 0
+    N = len(doc_tokens)
+
+    for i, aoi_tok in enumerate(aoi_tokens):
+        raw = aoi_tok.strip()
+        if raw and all(ch in _PUNCT_ONLY for ch in raw):
+            # Pure punctuation is known to normalize to "" without normalizing
+            tgt_pass1 = ""
+        else:
+            tgt_pass1 = normalize_token_pass1(aoi_tok)
+
+        # Handle pure punctuation AOIs by literal match
+        if tgt_pass1 == "" and raw:
+            while j < N and doc_tokens[j].strip() != raw:
+                j += 1
+            if j < N and doc_tokens[j].strip() == raw:
+                mapping[i] = j
+                j += 1
+            continue
+
+        if tgt_pass1 == "":
+            # Empty after normalization; skip
+            continue
+
+        tgt_pass2 = normalize_token_pass2(aoi_tok)
+
+        if index1 is None:
+            hit = _scan_windows(norm1, norm2, tgt_pass1, tgt_pass2, j, max_window)
+        else:
+            hits = [
+                h for h in (
+                    _lookup_window(index1, tgt_pass1, j),
+                    _lookup_window(index2, tgt_pass2, j),
+                ) if h is not None
+            ]
+            hit = min(hits) if hits else None
+
+        if hit is None:
+            j = min(j + 1, N)
+            continue
+
+        k, w = hit
+        mapping[i] = k
+        j = k + w
+
+    return mapping
 
 
 def align_aoi_to_spacy_windowed(
@@ -31,6 +200,9 @@ def align_aoi_to_spacy_windowed(
 ) -> List[Optional[int]]:
     """
     Improved greedy left-to-right alignment with two-pass normalization.
+
+    For longer AOI lists, candidate windows are looked up in a hash index of
+    normalized doc-token windows instead of being scanned for every AOI token.
     
     Uses a two-pass approach:
     1. First try matching with pass1 normalization (retains apostrophes/hyphens)
@@ -46,60 +218,102 @@ def align_aoi_to_spacy_windowed(
     Returns:
         List of spaCy token indices (or None) corresponding to each AOI token
     """
-    mapping: List[Optional[int]] = [None] * len(aoi_tokens)
-    j = 0
-    N = len(doc_tokens)
+    # Normalize each doc token once; windows are built from these pieces
+    norm1 = [normalize_token_pass1(t) for t in doc_tokens]
+    norm2 = [normalize_token_pass2(t) for t in doc_tokens]
 
-    for i, aoi_tok in enumerate(aoi_tokens):
-        raw = aoi_tok.strip()
-        tgt_pass1 = normalize_token_pass1(aoi_tok)
-        tgt_pass2 = normalize_token_pass2(aoi_tok)
+    # Index windows by their normalized form so each AOI lookup is a dict hit
+    index1 = index2 = None
+    if len(aoi_tokens) >= _INDEX_MIN_AOI:
+        index1 = _build_window_index(norm1, max_window)
+        index2 = _build_window_index(norm2, max_window)
 
-        # Handle pure punctuation AOIs by literal match
-        if tgt_pass1 == "" and raw:
-            while j < N and doc_tokens[j].strip() != raw:
-                j += 1
-            if j < N and doc_tokens[j].strip() == raw:
-                mapping[i] = j
-                j += 1
-            continue
+    return _align(aoi_tokens, doc_tokens, norm1, norm2, index1, index2, max_window)
 
-        if tgt_pass1 == "":
-            # Empty after normalization; skip
-            continue
 
-        matched = False
-        k = j
+def align_aoi_to_spacy_batch(
+    pairs: List[Tuple[List[str], List[str]]],
+    max_window: int = 4
+) -> List[List[Optional[int]]]:
+    """
+    Align many (aoi_tokens, doc_tokens) pairs with align_aoi_to_spacy_windowed.
+
+    Doc-token normalizations and window indexes are memoized per distinct
+    doc-token sequence, so a stimulus shown to many subjects is normalized
+    and indexed only once.
+    
+    Args:
+        pairs: List of (AOI token strings, spaCy doc token strings) pairs
+        max_window: Maximum number of spaCy tokens to concatenate for matching
         
-        # Try matching with both normalization passes
-        while k < N and not matched:
-            for w in range(1, max_window + 1):
-                if k + w > N:
-                    break
-                    
-                # Try pass1 normalization first (preserves apostrophes/hyphens)
-                window_norm_pass1 = "".join(normalize_token_pass1(t) for t in doc_tokens[k:k + w])
-                if window_norm_pass1 == tgt_pass1:
-                    mapping[i] = k
-                    j = k + w
-                    matched = True
-                    break
-                
-                # If pass1 failed, try pass2 normalization (strips apostrophes/hyphens)
-                window_norm_pass2 = "".join(normalize_token_pass2(t) for t in doc_tokens[k:k + w])
-                if window_norm_pass2 == tgt_pass2:
-                    mapping[i] = k
-                    j = k + w
-                    matched = True
-                    break
-                    
-            if not matched:
-                k += 1
-
-        if not matched:
-            j = min(j + 1, N)
+    Returns:
+        One alignment per pair, as returned by align_aoi_to_spacy_windowed
+    """
+    alignments = []
+    for aoi_tokens, doc_tokens in pairs:
+        key = tuple(doc_tokens)
+        norm1, norm2 = _normalize_doc(key)
+        index1 = index2 = None
+        if len(aoi_tokens) >= _INDEX_MIN_AOI:
+            index1, index2 = _index_doc(key, max_window)
+        alignments.append(
+            _align(aoi_tokens, doc_tokens, norm1, norm2, index1, index2, max_window)
+        )
+    return alignments
+
+
+# Per-doc lookups, held weakly so they are dropped with their Doc and never
+# serialized with it (unlike Doc.user_data)
+_DOC_CACHE: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_SIGNATURE_KEY = "signature"
+_N_TOKENS_KEY = "n_tokens"
+_SENT_OF_KEY = "sent_of"
+_DEPTHS_KEY = "depths"
+
+# Dependency depths are capped at this many steps
+_MAX_DEPTH = 51
+
+
+def _parse_signature(doc) -> bytes:
+    """Snapshot of the doc's HEAD and SENT_START arrays, used to detect re-parses."""
+    return doc.to_array([HEAD, SENT_START]).tobytes()
+
+
+def _cached(doc, key: str, build: Callable[[Any], Any], validate: bool = False) -> Any:
+    """
+    Return build(doc), computed once per doc.
+
+    Per-token callers only check that the token count is unchanged, which keeps
+    each lookup O(1). Doc-level callers pass ``validate=True`` to also compare
+    the doc's HEAD/SENT_START arrays and drop entries from an earlier parse.
+    """
+    entry = _DOC_CACHE.get(doc)
+    if validate or entry is None or entry[_N_TOKENS_KEY] != len(doc):
+        signature = _parse_signature(doc)
+        if entry is None or entry[_SIGNATURE_KEY] != signature:
+            entry = {_SIGNATURE_KEY: signature, _N_TOKENS_KEY: len(doc)}
+            _DOC_CACHE[doc] = entry
+    if key not in entry:
+        entry[key] = build(doc)
+    return entry[key]
+
+
+def _build_sent_of(doc) -> List[Tuple[int, int]]:
+    """Map each token index of a doc to the (start, end) bounds of its sentence."""
+    sent_of: List[Tuple[int, int]] = []
+    for sent in doc.sents:
+        bounds = (sent.start, sent.end)
+        sent_of.extend([bounds] * (sent.end - sent.start))
+    return sent_of
 
-    return mapping
+
+def _sent_of(doc) -> List[Tuple[int, int]]:
+    """
+    Map each token index of a doc to the (start, end) bounds of its sentence.
+
+    The lookup is cached per doc so that per-token dependency metrics don't re-iterate ``doc.sents``.
+    """
+    return _cached(doc, _SENT_OF_KEY, _build_sent_of)
 
 
 def dep_distance(token) -> int:
@@ -119,31 +333,88 @@ def dep_distance(token) -> int:
     if token.head == token:
         return 0
     
-    # Check if head is in the same sentence (for robustness)
-    # Get sentence boundaries
-    token_sent = None
-    head_sent = None
-    
-    for sent in token.doc.sents:
-        if sent.start <= token.i < sent.end:
-            token_sent = sent
-        if sent.start <= token.head.i < sent.end:
-            head_sent = sent
-            
     # If cross-sentence dependency, return 0 for consistency
-    if token_sent != head_sent:
+    sent_of = _sent_of(token.doc)
+    if sent_of[token.i] != sent_of[token.head.i]:
         return 0
         
     # Otherwise return linear distance
     return abs(token.i - token.head.i)
 
 
+def _build_depth_table(doc) -> List[int]:
+    """
+    Sentence-local dependency depth of every token of a doc, by dynamic programming.
+
+    Each head chain is walked only until it reaches a token whose depth is
+    already known, so shared ancestors are resolved once per doc.
+    """
+    n = len(doc)
+    table = [-1] * n
+    if n:
+        # HEAD holds relative offsets stored as uint64; reinterpret and make absolute
+        heads = (np.arange(n) + doc.to_array(HEAD).astype(np.int64)).tolist()
+        sent_of = _sent_of(doc)
+
+        for i in range(n):
+            # Walk up until reaching a token whose depth is known or decidable
+            path = []
+            node = i
+            while table[node] < 0 and len(path) < _MAX_DEPTH:
+                head = heads[node]
+                if head == node:
+                    # ROOT
+                    table[node] = 0
+                elif sent_of[head] != sent_of[node]:
+                    # Head is outside sentence, treat as sentence root
+                    table[node] = 1
+                else:
+                    path.append(node)
+                    node = head
+
+            if table[node] < 0:
+                # Chain too deep (or cyclic) to resolve here; i is at least at the cap
+                table[i] = _MAX_DEPTH
+                continue
+
+            depth = table[node]
+            for node in reversed(path):
+                depth = min(depth + 1, _MAX_DEPTH)
+                table[node] = depth
+
+    return table
+
+
+def _doc_depth_table(doc, validate: bool = False) -> List[int]:
+    """Sentence-local dependency depth of every token of a doc, cached per doc."""
+    return _cached(doc, _DEPTHS_KEY, _build_depth_table, validate=validate)
+
+
+def dep_depths_doc(doc) -> np.ndarray:
+    """
+    Calculate sentence-local dependency depths for every token of a doc at once.
+
+    This also revalidates the doc's cached lookups against its current parse,
+    so call it after re-parsing a doc or editing its heads or sentence
+    boundaries; the per-token dep_depth/dep_distance only notice a change in
+    the number of tokens.
+
+    Args:
+        doc: spaCy Doc object
+
+    Returns:
+        int32 array where entry i is dep_depth(doc[i])
+    """
+    return np.array(_doc_depth_table(doc, validate=True), dtype=np.int32)
+
+
 def dep_depth(token) -> int:
     """
     Calculate dependency depth consistently (sentence-local, ROOT=0).
     
     Returns the number of steps to ROOT within the sentence.
-    ROOT tokens have depth 0.
+    ROOT tokens have depth 0. A step onto a head outside the sentence is
+    counted and ends the walk.
     
     Args:
         token: spaCy Token object
@@ -151,32 +422,7 @@ def dep_depth(token) -> int:
     Returns:
         Dependency depth as integer
     """
-    depth = 0
-    current = token
-    
-    # Get sentence boundaries for this token
-    token_sent = None
-    for sent in token.doc.sents:
-        if sent.start <= token.i < sent.end:
-            token_sent = sent
-            break
-    
-    # Traverse up the dependency tree
-    while current.head != current:  # Until we reach ROOT
-        depth += 1
-        current = current.head
-        
-        # Check if we've moved outside the sentence
-        if token_sent:
-            if not (token_sent.start <= current.i < token_sent.end):
-                # Head is outside sentence, treat as sentence root
-                break
-        
-        # Prevent infinite loops
-        if depth > 50:
-            break
-            
-    return depth
+    return _doc_depth_table(token.doc)[token.i]
 
 
 def is_punctuation_token(token) -> bool:
@@ -189,4 +435,5 @@ def is_punctuation_token(token) -> bool:
     Returns:
         True if token is punctuation and should be excluded from predictors
     """
-    return token.pos_ == "PUNCT" or token.is_punct
\ No newline at end of file
+    # Compare the integer POS id to avoid building the pos_ string
+    return token.pos == _PUNCT_ID or token.is_punct
\ No newline at end of file
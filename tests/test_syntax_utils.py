@@ -6,10 +6,14 @@ Tests the improved alignment and dependency calculation functions.
 
 import pytest
 import spacy
+from spacy.tokens import Doc
+from scripts import syntax_utils
 from scripts.syntax_utils import (
+    align_aoi_to_spacy_batch,
     align_aoi_to_spacy_windowed,
     dep_distance,
     dep_depth,
+    dep_depths_doc,
     is_punctuation_token,
     normalize_token_pass1,
     normalize_token_pass2
@@ -22,6 +26,16 @@ def nlp():
     return spacy.load("en_core_web_sm")
 
 
+def _two_sentence_doc():
+    """Build a parsed two-sentence Doc by hand (no trained model needed)."""
+    return Doc(
+        spacy.blank("en").vocab,
+        words=["The", "dog", "barks", ".", "It", "sleeps", "soundly", "."],
+        heads=[1, 2, 2, 2, 5, 5, 5, 5],
+        deps=["det", "nsubj", "ROOT", "punct", "nsubj", "ROOT", "advmod", "punct"],
+    )
+
+
 def test_normalization_functions():
     """Test the two-pass normalization functions."""
     # Test pass1 normalization (keeps apostrophes and hyphens)
@@ -37,6 +51,19 @@ def test_normalization_functions():
     assert normalize_token_pass2("can't!") == "cant"
 
 
+def test_normalization_cache():
+    """Test that repeated normalizations are served from the cache."""
+    normalize_token_pass1.cache_clear()
+    normalize_token_pass2.cache_clear()
+
+    for _ in range(3):
+        assert normalize_token_pass1("The") == "the"
+        assert normalize_token_pass2("won't") == "wont"
+
+    assert normalize_token_pass1.cache_info().hits == 2
+    assert normalize_token_pass2.cache_info().hits == 2
+
+
 def test_alignment_contractions_and_hyphens(nlp):
     """Test alignment with contractions and hyphenated words."""
     # Test sentence with contractions and hyphens
@@ -77,6 +104,35 @@ def test_alignment_window_concatenation(nlp):
     assert alignment[1] is not None, f"Failed to align hyphenated compound. Alignment: {alignment}, Doc tokens: {doc_tokens}"
 
 
+def test_alignment_indexed_lookup():
+    """Test that long AOI lists (indexed lookup) align like short ones (direct scan)."""
+    doc_tokens = ["He", "wo", "n't", "re", "-", "enter", "the", "well", "-", "known", "room", "."]
+    aoi_tokens = ["He", "won't", "re-enter", "the", "well-known", "room", "."]
+    expected = [0, 1, 3, 6, 7, 10, 11]
+
+    assert align_aoi_to_spacy_windowed(aoi_tokens, doc_tokens, max_window=4) == expected
+
+    # Repeating the text pushes the AOI list onto the indexed path
+    alignment = align_aoi_to_spacy_windowed(aoi_tokens * 2, doc_tokens * 2, max_window=4)
+    assert alignment == expected + [idx + len(doc_tokens) for idx in expected]
+
+
+def test_alignment_batch():
+    """Test that batched alignment matches aligning each pair separately."""
+    doc_tokens = ["He", "wo", "n't", "re", "-", "enter", "the", "well", "-", "known", "room", "."]
+    pairs = [
+        (["He", "won't", "re-enter", "the", "well-known", "room", "."], doc_tokens),
+        (["the", "wellknown", "room"], doc_tokens),
+        (["He", "wont", "reenter"] * 3, doc_tokens * 3),
+        ([], doc_tokens),
+    ]
+
+    expected = [align_aoi_to_spacy_windowed(aoi, doc, max_window=4) for aoi, doc in pairs]
+
+    assert align_aoi_to_spacy_batch(pairs, max_window=4) == expected
+    assert align_aoi_to_spacy_batch([], max_window=4) == []
+
+
 def test_dep_distance_calculations(nlp):
     """Test dependency distance calculations."""
     text = "The quick brown fox jumps."
@@ -126,6 +182,79 @@ def test_dep_depth_calculations(nlp):
             assert depth <= 10, f"Unusually high depth {depth} for token {token.text}"
 
 
+def test_dep_depths_doc(nlp):
+    """Test that doc-level depths agree with per-token depths."""
+    text = "The quick brown fox jumps. It lands on the old fence."
+    doc = nlp(text)
+
+    depths = dep_depths_doc(doc)
+
+    assert len(depths) == len(doc)
+    assert list(depths) == [dep_depth(token) for token in doc]
+    for token in doc:
+        if token.head == token:
+            assert depths[token.i] == 0
+        elif token.head.head == token.head:
+            assert depths[token.i] == 1
+
+
+def test_dependency_cache_follows_parse():
+    """Test that cached per-doc lookups stay out of user_data and refresh via dep_depths_doc."""
+    doc = _two_sentence_doc()
+
+    assert [dep_depth(t) for t in doc] == [2, 1, 0, 1, 1, 0, 1, 1]
+    assert [dep_distance(t) for t in doc] == [1, 1, 0, 1, 1, 0, 1, 2]
+    assert doc.user_data == {}
+
+    # Re-attach "The" directly to the ROOT verb; the doc-level call picks up the new parse
+    doc[0].head = doc[2]
+
+    assert list(dep_depths_doc(doc)) == [1, 1, 0, 1, 1, 0, 1, 1]
+    assert [dep_depth(t) for t in doc] == [1, 1, 0, 1, 1, 0, 1, 1]
+    assert [dep_distance(t) for t in doc] == [2, 1, 0, 1, 1, 0, 1, 2]
+
+
+def test_per_token_pass_is_linear(monkeypatch):
+    """Test that per-token passes over a long doc validate its parse only once."""
+    sent_len = 20
+    heads = [
+        s + k + 1 if k < sent_len - 1 else s + k
+        for s in range(0, 4000, sent_len)
+        for k in range(sent_len)
+    ]
+    doc = Doc(
+        spacy.blank("en").vocab,
+        words=["w"] * len(heads),
+        heads=heads,
+        deps=["ROOT" if h == i else "dep" for i, h in enumerate(heads)],
+    )
+
+    calls = []
+    parse_signature = syntax_utils._parse_signature
+    monkeypatch.setattr(
+        syntax_utils, "_parse_signature", lambda d: calls.append(d) or parse_signature(d)
+    )
+
+    depths = [dep_depth(t) for t in doc]
+    distances = [dep_distance(t) for t in doc]
+
+    assert depths[:sent_len] == list(range(sent_len - 1, -1, -1))
+    assert distances[:sent_len] == [1] * (sent_len - 1) + [0]
+    assert len(calls) == 1
+
+
+def test_dependency_metrics_after_serialization():
+    """Test that distances and depths survive a Doc to_bytes/from_bytes round-trip."""
+    doc = _two_sentence_doc()
+    distances = [dep_distance(t) for t in doc]
+    depths = [dep_depth(t) for t in doc]
+
+    reloaded = Doc(doc.vocab).from_bytes(doc.to_bytes())
+
+    assert [dep_distance(t) for t in reloaded] == distances
+    assert [dep_depth(t) for t in reloaded] == depths
+
+
 def test_cross_sentence_dependencies(nlp):
     """Test handling of cross-sentence dependencies."""
     text = "First sentence. Second sentence has more words."